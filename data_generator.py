@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import numpy as np
 
@@ -13,41 +14,75 @@ EUROPE_BOUNDS = {
     'max_lon': 40.0     # east 
 }
 
+# Single seeded random generator, so every run produces the same data
+SEED = 42
+rng = np.random.default_rng(SEED)
+
+LOW = [[EUROPE_BOUNDS['min_lat']], [EUROPE_BOUNDS['min_lon']]]
+HIGH = [[EUROPE_BOUNDS['max_lat']], [EUROPE_BOUNDS['max_lon']]]
+
 # Gerar 100 Suppliers
+supplier_ids = np.char.add("Supplier_ID", np.arange(1, 101).astype(str))
+supplier_lat, supplier_lon = np.round(rng.uniform(LOW, HIGH, size=(2, 100)))
+
+# Gerar 100 Customers
+customer_ids = np.char.add("Customer_ID", np.arange(1, 101).astype(str))
+customer_lat, customer_lon = np.round(rng.uniform(LOW, HIGH, size=(2, 100)))
+
+# Generate 500 shipments (250 inbound, 250 outbound)
+shipment_numbers = np.arange(1, 251).astype(str)
+inbound_supplier = rng.choice(100, 250)
+outbound_customer = rng.choice(100, 250)
+inbound_volume, outbound_volume = np.round(rng.uniform(10, 100, size=(2, 250)))
+
 suppliers = pd.DataFrame({
-    "Supplier_ID": [f"Supplier_ID{i}" for i in range(1, 101)],
-    "Latitude": np.round(np.random.uniform(EUROPE_BOUNDS['min_lat'], EUROPE_BOUNDS['max_lat'], 100)), 
-    "Longitude": np.round(np.random.uniform(EUROPE_BOUNDS['min_lon'], EUROPE_BOUNDS['max_lon'], 100))
+    "Supplier_ID": supplier_ids,
+    "Latitude": supplier_lat,
+    "Longitude": supplier_lon
 })
 
-# Gerar 100 Customers
 customers = pd.DataFrame({
-    "Customer_ID": [f"Customer_ID{i}" for i in range(1, 101)],
-    "Latitude": np.round(np.random.uniform(EUROPE_BOUNDS['min_lat'], EUROPE_BOUNDS['max_lat'], 100)),
-    "Longitude": np.round(np.random.uniform(EUROPE_BOUNDS['min_lon'], EUROPE_BOUNDS['max_lon'], 100))
+    "Customer_ID": customer_ids,
+    "Latitude": customer_lat,
+    "Longitude": customer_lon
 })
 
-# Generate 500 shipments (250 inbound, 250 outbound)
 inbound = pd.DataFrame({
-    "Shipment_ID": [f"Inbound_{i}" for i in range(1, 251)],
-    "Origin": np.random.choice(suppliers["Supplier_ID"], 250),
+    "Shipment_ID": np.char.add("Inbound_", shipment_numbers),
+    "Origin": supplier_ids[inbound_supplier],
     "Destination": "Warehouse",
-    "Volume_m³": np.round(np.random.uniform(10, 100, 250)) 
+    "Volume_m³": inbound_volume,
+    # Coordinates of the supplier, so loading needs no merge
+    "Latitude": supplier_lat[inbound_supplier],
+    "Longitude": supplier_lon[inbound_supplier]
 })
 
 outbound = pd.DataFrame({
-    "Shipment_ID": [f"Outbound_{i}" for i in range(1, 251)],
+    "Shipment_ID": np.char.add("Outbound_", shipment_numbers),
     "Origin": "Warehouse",
-    "Destination": np.random.choice(customers["Customer_ID"], 250),
-    "Volume_m³": np.round(np.random.uniform(10, 100, 250))
+    "Destination": customer_ids[outbound_customer],
+    "Volume_m³": outbound_volume,
+    # Coordinates of the customer, so loading needs no merge
+    "Latitude": customer_lat[outbound_customer],
+    "Longitude": customer_lon[outbound_customer]
 })
 
-shipments = pd.concat([inbound, outbound])
-
-# Save CSV (no index)
+# Save CSV (no index); outbound is appended below inbound in the same file
 suppliers.to_csv("suppliers.csv", index=False)
 customers.to_csv("customers.csv", index=False)
-shipments.to_csv("shipments.csv", index=False)
+inbound.to_csv("shipments.csv", index=False)
+outbound.to_csv("shipments.csv", mode="a", header=False, index=False)
+
+# Save the numeric shipment arrays used by facility_location_problem.py, so it
+# can skip parsing the CSV files; it only trusts them while the CSV files keep
+# the modification times recorded here
+np.savez(
+    "shipments_prepared.npz",
+    mtimes=np.array([os.path.getmtime(path) for path in ("suppliers.csv", "customers.csv", "shipments.csv")]),
+    lats=np.concatenate([inbound["Latitude"], outbound["Latitude"]]),
+    lons=np.concatenate([inbound["Longitude"], outbound["Longitude"]]),
+    volumes=np.concatenate([inbound_volume, outbound_volume])
+)
 
 print("Arquivos gerados com sucesso!")
-print(f"Suppliers: {len(suppliers)} | Customers: {len(customers)} | Shipments: {len(shipments)}")
\ No newline at end of file
+print(f"Suppliers: {len(suppliers)} | Customers: {len(customers)} | Shipments: {len(inbound) + len(outbound)}")
\ No newline at end of file
@@ -1,8 +1,14 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import NamedTuple
 import pandas as pd
 import numpy as np
-from geopy.distance import distance
+from numba import njit
+from pyproj import Geod
 from scipy.optimize import minimize
 import folium
+from folium.plugins import FastMarkerCluster
 import webbrowser
 import os
 
@@ -10,55 +16,219 @@ import os
 # 1. AUXILIARY FUNCTIONS
 # =============================================
 
+EARTH_RADIUS_KM = 6371.0
+
+# WGS84 ellipsoid, for exact geodesic distances
+GEOD = Geod(ellps="WGS84")
+
+def to_unit_vectors(lats, lons):
+    """
+    Projects coordinates onto the unit sphere.
+    
+    Args:
+        lats (ndarray): Latitudes in degrees
+        lons (ndarray): Longitudes in degrees
+    
+    Returns:
+        ndarray: (3, N) array with the x, y and z components of each point
+    """
+    lats_rad, lons_rad = np.radians(lats), np.radians(lons)
+    cos_lats = np.cos(lats_rad)
+    return np.ascontiguousarray([cos_lats * np.cos(lons_rad), cos_lats * np.sin(lons_rad), np.sin(lats_rad)])
+
+@njit(fastmath=True, cache=True, nogil=True)
+def haversine_sum_km(lat, lon, points, radius_km=0.0):
+    """
+    Sums the great-circle distances from one point to many points, along
+    with the gradient of that sum with respect to the reference point.
+    
+    Compiled with Numba so the whole haversine formula, its derivative and
+    the reduction run in a single pass without temporary arrays. The points
+    are given as unit vectors, so the only per-point transcendental left is
+    the arcsine of the haversine formula.
+    
+    Args:
+        lat (float): Latitude of the reference point in degrees
+        lon (float): Longitude of the reference point in degrees
+        points (ndarray): (3, N) unit vectors of the other points
+        radius_km (float): Distance (km) within which a point counts as
+                           coinciding with the reference point
+    
+    Returns:
+        tuple: Sum of the distances in kilometers, its partial derivatives
+              with respect to latitude and longitude (km per degree), the sum
+              of the inverse distances (1/km) used by Weiszfeld's algorithm,
+              and the number of coinciding points. Coinciding points are left
+              out of the derivatives and of the inverse distances.
+    """
+    lat_rad = math.radians(lat)
+    lon_rad = math.radians(lon)
+    sin_lat = math.sin(lat_rad)
+    cos_lat = math.cos(lat_rad)
+    sin_lon = math.sin(lon_rad)
+    cos_lon = math.cos(lon_rad)
+    # Reference unit vector and its derivatives w.r.t. latitude and longitude
+    ux, uy, uz = cos_lat * cos_lon, cos_lat * sin_lon, sin_lat
+    dlat_x, dlat_y, dlat_z = -sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat
+    dlon_x, dlon_y = -cos_lat * sin_lon, cos_lat * cos_lon
+    total = 0.0
+    grad_lat = 0.0
+    grad_lon = 0.0
+    inv_sum = 0.0
+    coincident = 0
+    for i in range(points.shape[1]):
+        px, py, pz = points[0, i], points[1, i], points[2, i]
+        # a = sin^2(c / 2) = |u - p|^2 / 4 for the central angle c; the chord
+        # form stays exact for nearby points, unlike (1 - u.p) / 2
+        a = min(((ux - px) ** 2 + (uy - py) ** 2 + (uz - pz) ** 2) / 4, 1.0)
+        d = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+        total += d
+        # d(distance)/da is singular when the point coincides with (or is
+        # antipodal to) the reference point; its contribution is then zero
+        if d <= radius_km:
+            coincident += 1
+        elif a < 1.0:
+            dd_da = EARTH_RADIUS_KM / math.sqrt(a * (1.0 - a))
+            da_dlat = -0.5 * (dlat_x * px + dlat_y * py + dlat_z * pz)
+            da_dlon = -0.5 * (dlon_x * px + dlon_y * py)
+            grad_lat += dd_da * da_dlat
+            grad_lon += dd_da * da_dlon
+            inv_sum += 1.0 / d
+    deg = math.pi / 180.0
+    return total, grad_lat * deg, grad_lon * deg, inv_sum, coincident
+
+class ShipmentArrays(NamedTuple):
+    """
+    Shipment endpoints and volumes stored as one array per field.
+    
+    Attributes:
+        lats (ndarray): Latitudes of the supplier/customer of each shipment
+        lons (ndarray): Longitudes of the supplier/customer of each shipment
+        volumes (ndarray): Volume of each shipment in cubic meters
+        points (ndarray): (3, N) unit vectors of the endpoints
+    """
+    lats: np.ndarray
+    lons: np.ndarray
+    volumes: np.ndarray
+    points: np.ndarray
+
+    @classmethod
+    def from_arrays(cls, lats, lons, volumes):
+        """
+        Builds the arrays from endpoint coordinates and volumes.
+        
+        Args:
+            lats (ndarray): Latitudes of the endpoints in degrees
+            lons (ndarray): Longitudes of the endpoints in degrees
+            volumes (ndarray): Volumes in cubic meters
+        
+        Returns:
+            ShipmentArrays: Arrays for the given shipments
+        """
+        return cls(lats, lons, volumes, to_unit_vectors(lats, lons))
+
+    @classmethod
+    def from_frame(cls, frame):
+        """
+        Extracts the arrays from shipments data.
+        
+        Args:
+            frame (DataFrame): Shipments with supplier or customer coordinates
+        
+        Returns:
+            ShipmentArrays: Arrays for the given shipments
+        """
+        return cls.from_arrays(frame["Latitude"].to_numpy(), frame["Longitude"].to_numpy(),
+                               frame["Volume_m³"].to_numpy())
+
+CSV_FILES = ("suppliers.csv", "customers.csv", "shipments.csv")
+
+# Numeric-only shipment arrays, written by data_generator.py (or by the first
+# load after the CSV files change) with the fields below, plus the
+# modification times of CSV_FILES ("mtimes") they were prepared from
+PREPARED_FILE = "shipments_prepared.npz"
+PREPARED_FIELDS = ("lats", "lons", "volumes")
+
 def load_and_prepare_data():
     """
     Loads and prepares data from CSV files.
     
+    Each shipment row carries the coordinates of its supplier or customer, and
+    inbound and outbound shipments cost the same per kilometer, so all of them
+    are read into one set of arrays that the optimizer reduces in a single
+    pass. While the modification times stored in PREPARED_FILE match those of
+    the CSV files exactly, the shipment arrays are loaded from it directly
+    instead of parsing shipments.csv; otherwise it is rebuilt from the CSV
+    files.
+    
     Returns:
-        tuple: Contains DataFrames for inbound shipments, outbound shipments,
-              suppliers, and customers data
+        tuple: Contains ShipmentArrays for all (inbound and outbound) shipments,
+              and DataFrames for suppliers and customers data
     """
     suppliers = pd.read_csv("suppliers.csv")
     customers = pd.read_csv("customers.csv")
-    shipments = pd.read_csv("shipments.csv")
     
-    inbound = shipments[shipments["Destination"] == "Warehouse"].copy()
-    outbound = shipments[shipments["Origin"] == "Warehouse"].copy()
+    mtimes = np.array([os.path.getmtime(path) for path in CSV_FILES])
+    if os.path.exists(PREPARED_FILE):
+        with np.load(PREPARED_FILE) as prepared:
+            if ({"mtimes", *PREPARED_FIELDS} <= set(prepared.files)
+                    and np.array_equal(prepared["mtimes"], mtimes)):
+                shipments = ShipmentArrays.from_arrays(*(prepared[field] for field in PREPARED_FIELDS))
+                return shipments, suppliers, customers
     
-    inbound = pd.merge(inbound, suppliers, left_on="Origin", right_on="Supplier_ID", how="left")
-    outbound = pd.merge(outbound, customers, left_on="Destination", right_on="Customer_ID", how="left")
+    shipments = ShipmentArrays.from_frame(
+        pd.read_csv("shipments.csv", usecols=["Latitude", "Longitude", "Volume_m³"])
+    )
     
-    return inbound, outbound, suppliers, customers
+    np.savez(PREPARED_FILE, mtimes=mtimes, **{field: getattr(shipments, field) for field in PREPARED_FIELDS})
+    
+    return shipments, suppliers, customers
 
-def calculate_total_cost(warehouse_coords, inbound, outbound, distance_cost=0.5, volume_cost=10):
+def calculate_total_cost(warehouse_coords, shipments, distance_cost=0.5, volume_cost=10, geodesic=False):
     """
     Calculates the total cost given warehouse coordinates.
     
     Args:
         warehouse_coords (tuple): Latitude and longitude of the warehouse
-        inbound (DataFrame): Inbound shipments data
-        outbound (DataFrame): Outbound shipments data
+        shipments (ShipmentArrays): Inbound and outbound shipments data
         distance_cost (float): Cost per kilometer of distance
         volume_cost (float): Cost per cubic meter of volume
+        geodesic (bool): Use geodesic distances on the WGS84 ellipsoid instead
+                         of great-circle distances on a sphere
     
     Returns:
         float: Total cost for all shipments
     """
     warehouse_lat, warehouse_lon = warehouse_coords
     
-    inbound["Distance_km"] = inbound.apply(
-        lambda row: distance((row["Latitude"], row["Longitude"]), (warehouse_lat, warehouse_lon)).km,
-        axis=1
-    )
-    inbound["Cost"] = (inbound["Distance_km"] * distance_cost) + (inbound["Volume_m³"] * volume_cost)
+    if geodesic:
+        # One vectorized call for all shipments
+        _, _, distances_m = GEOD.inv(
+            shipments.lons, shipments.lats,
+            np.full(shipments.lons.shape, warehouse_lon, dtype=float),
+            np.full(shipments.lats.shape, warehouse_lat, dtype=float)
+        )
+        distance_km = distances_m.sum() * 1e-3
+    else:
+        distance_km = haversine_sum_km(warehouse_lat, warehouse_lon, shipments.points)[0]
     
-    outbound["Distance_km"] = outbound.apply(
-        lambda row: distance((warehouse_lat, warehouse_lon), (row["Latitude"], row["Longitude"])).km,
-        axis=1
-    )
-    outbound["Cost"] = (outbound["Distance_km"] * distance_cost) + (outbound["Volume_m³"] * volume_cost)
+    return distance_km * distance_cost + shipments.volumes.sum() * volume_cost
+
+def marker_callback(color, icon):
+    """
+    Builds the JavaScript callback that FastMarkerCluster uses to draw each point.
     
-    return inbound["Cost"].sum() + outbound["Cost"].sum()
+    Args:
+        color (str): Marker color
+        icon (str): Font Awesome icon name
+    
+    Returns:
+        str: JavaScript function creating a marker from a [lat, lon, popup] row
+    """
+    return f"""function (row) {{
+        var icon = L.AwesomeMarkers.icon({{icon: "{icon}", prefix: "fa", markerColor: "{color}"}});
+        return L.marker(new L.LatLng(row[0], row[1]), {{icon: icon}}).bindPopup(row[2]);
+    }}"""
 
 def create_interactive_map(optimal_coords, suppliers, customers, cost_history):
     """
@@ -73,21 +243,21 @@ def create_interactive_map(optimal_coords, suppliers, customers, cost_history):
     # Create base map centered on optimal location
     m = folium.Map(location=optimal_coords, zoom_start=6)
     
-    # Add suppliers (red markers)
-    for _, row in suppliers.iterrows():
-        folium.Marker(
-            location=[row["Latitude"], row["Longitude"]],
-            popup=f"Supplier {row['Supplier_ID']}",
-            icon=folium.Icon(color="red", icon="truck", prefix="fa")
-        ).add_to(m)
-    
-    # Add customers (blue markers)
-    for _, row in customers.iterrows():
-        folium.Marker(
-            location=[row["Latitude"], row["Longitude"]],
-            popup=f"Customer {row['Customer_ID']}",
-            icon=folium.Icon(color="blue", icon="user", prefix="fa")
-        ).add_to(m)
+    # Add suppliers (red markers), clustered and rendered in the browser
+    FastMarkerCluster(
+        data=[[lat, lon, f"Supplier {supplier_id}"] for supplier_id, lat, lon
+              in suppliers[["Supplier_ID", "Latitude", "Longitude"]].itertuples(index=False, name=None)],
+        callback=marker_callback(color="red", icon="truck"),
+        name="Suppliers"
+    ).add_to(m)
+    
+    # Add customers (blue markers), clustered and rendered in the browser
+    FastMarkerCluster(
+        data=[[lat, lon, f"Customer {customer_id}"] for customer_id, lat, lon
+              in customers[["Customer_ID", "Latitude", "Longitude"]].itertuples(index=False, name=None)],
+        callback=marker_callback(color="blue", icon="user"),
+        name="Customers"
+    ).add_to(m)
     
     # Add optimal warehouse (green star)
     folium.Marker(
@@ -96,17 +266,15 @@ def create_interactive_map(optimal_coords, suppliers, customers, cost_history):
         icon=folium.Icon(color="green", icon="star", prefix="fa")
     ).add_to(m)
     
-    # Add cost history as a feature group
+    # Add cost history as a single line, one vertex per iteration
     cost_group = folium.FeatureGroup(name="Optimization Progress")
-    for i, cost in enumerate(cost_history):
+    if cost_history:
         cost_group.add_child(
-            folium.CircleMarker(
-                location=[optimal_coords[0] + 0.1, optimal_coords[1] + 0.1 + i*0.01],
-                radius=5,
+            folium.PolyLine(
+                locations=[[optimal_coords[0] + 0.001 * i, optimal_coords[1]] for i in range(len(cost_history))],
                 color="#3186cc",
-                fill=True,
-                fill_color="#3186cc",
-                popup=f"Iteration {i+1}: ${cost:,.2f}"
+                popup=(f"{len(cost_history)} iterations<br>"
+                       f"First: ${cost_history[0]:,.2f}<br>Last: ${cost_history[-1]:,.2f}")
             )
         )
     m.add_child(cost_group)
@@ -123,41 +291,138 @@ def create_interactive_map(optimal_coords, suppliers, customers, cost_history):
 # 2. OPTIMIZATION WITH COST HISTORY
 # =============================================
 
-def optimize_with_history(inbound, outbound, suppliers, customers):
+def optimize_with_history(shipments, suppliers, customers, distance_cost=0.5, volume_cost=10,
+                          method="weiszfeld", tol=1e-4, max_iter=100, n_starts=8, seed=None):
     """
     Optimizes warehouse location and stores cost history.
     
+    Objective evaluations are memoized on the coordinates rounded to 1e-6
+    degrees (~0.1 m), so the costs and gradients seen by the solvers are
+    those of the rounded point; the returned minimum cost is evaluated at
+    the exact optimal coordinates.
+    
     Args:
-        inbound (DataFrame): Inbound shipments data
-        outbound (DataFrame): Outbound shipments data
+        shipments (ShipmentArrays): Inbound and outbound shipments data
         suppliers (DataFrame): Suppliers data
         customers (DataFrame): Customers data
+        distance_cost (float): Cost per kilometer of distance
+        volume_cost (float): Cost per cubic meter of volume
+        method (str): "weiszfeld" for Weiszfeld's iteration or "L-BFGS-B"
+        tol (float): Weiszfeld step size (km) below which it stops, and distance
+                     (km) within which an endpoint counts as coinciding with
+                     the current point
+        max_iter (int): Maximum number of Weiszfeld iterations
+        n_starts (int): Number of parallel L-BFGS-B runs, the first one from the
+                        centroid and the others from random points in the bounds
+        seed (int): Seed for the random L-BFGS-B starting points
     
     Returns:
-        tuple: Contains optimal coordinates, minimum cost, and cost history
+        tuple: Contains optimal coordinates, minimum cost, cost history, and
+               the objective cache statistics (functools CacheInfo)
     """
+    if n_starts < 1:
+        raise ValueError(f"n_starts must be at least 1, got {n_starts}")
+    
     cost_history = []
     
-    def callback(xk):
-        cost_history.append(calculate_total_cost(xk, inbound, outbound))
-    
-    # Initial guess (geographic center)
-    initial_guess = [
-        (suppliers["Latitude"].mean() + customers["Latitude"].mean()) / 2,
-        (suppliers["Longitude"].mean() + customers["Longitude"].mean()) / 2
-    ]
-    
-    # Optimization
-    result = minimize(
-        fun=lambda coords: calculate_total_cost(coords, inbound, outbound),
-        x0=initial_guess,
-        method="L-BFGS-B",
-        bounds=[(suppliers["Latitude"].min(), suppliers["Latitude"].max()),
-               (suppliers["Longitude"].min(), suppliers["Longitude"].max())],
-        callback=callback
-    )
+    # Volume costs do not depend on the warehouse location
+    volume_constant = shipments.volumes.sum() * volume_cost
+    
+    @lru_cache(maxsize=64)
+    def evaluate(lat, lon):
+        d, g_lat, g_lon, w, coincident = haversine_sum_km(lat, lon, shipments.points, tol)
+        return (distance_cost * d + volume_constant, distance_cost * g_lat, distance_cost * g_lon,
+                distance_cost * w, distance_cost * coincident)
+    
+    def evaluate_at(coords):
+        # Quantize to 1e-6 degrees (~0.1 m) so near-duplicate probes are
+        # served from the cache
+        return evaluate(round(float(coords[0]), 6), round(float(coords[1]), 6))
+    
+    # The optimum lies within the area spanned by suppliers and customers
+    locations = pd.concat([suppliers[["Latitude", "Longitude"]], customers[["Latitude", "Longitude"]]])
+    bounds = list(zip(locations.min(), locations.max()))
+    lower, upper = zip(*bounds)
+    
+    # Initial guess (centroid of all shipment endpoints)
+    initial_guess = np.array([shipments.lats.mean(), shipments.lons.mean()])
+    
+    if method == "weiszfeld":
+        coords = initial_guess
+        
+        # Weiszfeld's iteration in the local equirectangular (tangent) plane:
+        # the planar update x - grad / sum(w_i / d_i) is expressed in degrees
+        # with the km-per-degree scale of the current latitude
+        km_per_deg = EARTH_RADIUS_KM * math.pi / 180.0
+        f, g_lat, g_lon, weight_sum, coincident_weight = evaluate_at(coords)
+        for _ in range(max_iter):
+            cos_lat = math.cos(math.radians(coords[0]))
+            # Gradient of the endpoints not at the current point (cost per km)
+            grad_y = g_lat / km_per_deg
+            grad_x = g_lon / (km_per_deg * cos_lat)
+            grad_norm = math.hypot(grad_x, grad_y)
+            # Vardi-Zhang: endpoints at the current point pull with their full
+            # weight, so it is optimal as soon as they outweigh the others
+            # (this also covers every endpoint sitting at the current point);
+            # otherwise the Weiszfeld step is shortened by their pull
+            if grad_norm <= coincident_weight:
+                break
+            scale = (1.0 - coincident_weight / grad_norm) / weight_sum
+            step = np.array([-scale * grad_y / km_per_deg, -scale * grad_x / (km_per_deg * cos_lat)])
+            new_coords = np.clip(coords + step, lower, upper)
+            step_km = km_per_deg * math.hypot(new_coords[0] - coords[0], (new_coords[1] - coords[1]) * cos_lat)
+            coords = new_coords
+            f, g_lat, g_lon, weight_sum, coincident_weight = evaluate_at(coords)
+            cost_history.append(f)
+            if step_km < tol:
+                break
+        
+        optimal_coords = coords
+    
+    elif method == "L-BFGS-B":
+        def run(x0):
+            history = []
+            
+            # Most recent objective value, read back by the callback
+            last = {"f": None}
+            
+            def objective(coords):
+                f, g_lat, g_lon, _, _ = evaluate_at(coords)
+                last["f"] = f
+                return f, np.array([g_lat, g_lon])
+            
+            def callback(xk):
+                # The last evaluation is at xk, so there is no need to
+                # evaluate the cost again
+                history.append(last["f"])
+            
+            result = minimize(
+                fun=objective,
+                x0=x0,
+                method="L-BFGS-B",
+                jac=True,
+                bounds=bounds,
+                callback=callback,
+                options={"maxiter": 50, "ftol": 1e-6, "gtol": 1e-5}
+            )
+            return result, history
+        
+        # Multi-start against local minima; the kernel releases the GIL, so
+        # the runs share the CPU cores
+        rng = np.random.default_rng(seed)
+        starts = np.vstack([initial_guess, rng.uniform(lower, upper, size=(n_starts - 1, 2))])
+        with ThreadPoolExecutor() as executor:
+            runs = list(executor.map(run, starts))
+        
+        result, history = min(runs, key=lambda outcome: outcome[0].fun)
+        cost_history.extend(history)
+        optimal_coords = result.x
+    
+    else:
+        raise ValueError(f"Unknown optimization method: {method}")
     
-    return result.x, result.fun, cost_history
+    optimal_cost = calculate_total_cost(optimal_coords, shipments, distance_cost, volume_cost)
+    return optimal_coords, optimal_cost, cost_history, evaluate.cache_info()
 
 # =============================================
 # 3. Main Function
@@ -166,14 +431,17 @@ def optimize_with_history(inbound, outbound, suppliers, customers):
 def main():
     """Executes the complete workflow and generates visualizations."""
     print("Loading data...")
-    inbound, outbound, suppliers, customers = load_and_prepare_data()
+    shipments, suppliers, customers = load_and_prepare_data()
     
     print("Optimizing location...")
-    optimal_coords, optimal_cost, cost_history = optimize_with_history(inbound, outbound, suppliers, customers)
+    optimal_coords, optimal_cost, cost_history, cache_info = optimize_with_history(shipments, suppliers, customers)
     
     print("\n=== RESULTS ===")
     print(f"Best location: Latitude = {optimal_coords[0]:.6f}, Longitude = {optimal_coords[1]:.6f}")
     print(f"Minimum total cost: ${optimal_cost:,.2f}")
+    print(f"Total cost with WGS84 geodesic distances: "
+          f"${calculate_total_cost(optimal_coords, shipments, geodesic=True):,.2f}")
+    print(f"Objective cache: {cache_info.hits} hits / {cache_info.hits + cache_info.misses} evaluations")
     
     # Create interactive map
     print("\nGenerating interactive map...")